@@ -14,17 +14,37 @@ the original column.
 * Step 2: Drop study records that are not "interventional"
 * Step 3: Split column "Study Designs"
 * Step 4: Add column "Intervention Methods"
-* Step 5: Compute and add column "Duration (yr)"
+* Step 5: Compute and add columns "Duration (yr)", "Duration (day)" and
+  "Start Date (ordinal)", the start date as a proleptic Gregorian ordinal
 
 The output is a CSV file named 'Data_after_processing.csv'
 
+Records that fail to parse are not silently dropped, they are written to
+'Quarantined_records.csv' together with a reason code and the exception
+class. After a parser fix, run `python Module1_Data_Scrubbing.py reprocess`
+to rerun only the quarantined records and append the recovered ones.
+
+Run without arguments for the step-by-step walkthrough. For batch runs,
+e.g. from cron, use the non-interactive command:
+
+    python Module1_Data_Scrubbing.py scrub --raw Raw.csv --output Out.csv --workers 4
+
+Options can also be read from an INI file with --config (section [scrub]).
+
 @author: Melody Shi
 """
 
+import argparse
+import configparser
 import csv
+import multiprocessing
+import os
+import sys
 import time
 import datetime
+import zlib
 from time import strptime
+from functools import partial
 
 def get_index(header,columns):
     """
@@ -166,7 +186,7 @@ def split_multivalue_entry(row, header, feature):
         try:
             # first item in the list is key, second is value
             dictionary[key_value_list[0].strip()] = [key_value_list[1].strip()]
-        except:
+        except IndexError:
             dictionary[key_value_list[0].strip()].append(key_value_list[1].strip())
     return dictionary
 
@@ -194,150 +214,640 @@ def to_datetime(raw_date):
         mon = date_list[0].strip()
         day = int(date_list[1].strip())
         year = int(date_list[2].strip())
+    else:
+        raise ValueError("unrecognized date: {!r}".format(raw_date))
 
     mon = strptime(mon,"%B").tm_mon # convert month name to an integer representing the month
     date_obj = datetime.date(year,mon,day) # build a datetime object
     return date_obj
 
-def main():
-    output = 'Data_after_processing2.csv'
-    with open('Raw_ClinicalTrial.csv',encoding='utf-8',errors='ignore') as f1, open(output,'w', newline='') as f2:
-        reader = csv.reader(f1,delimiter=',')
-        spamwriter = csv.writer(f2, delimiter=',')
+class RecordRejected(Exception):
+    """
+        Raised when a study record cannot be scrubbed and has to be quarantined
         
-        # instantiate counters
-        counter = 0 
-        dropped_records = 0
-        processed_rows = 0
-        header = []
-        index_to_drop = []
+        Attributes
+        ----------
+        reason: str
+            a reason code, one of the REASON_* constants
+        error: Exception
+            the exception raised while parsing the record
+    """
+    def __init__(self, reason, error):
+        super().__init__(reason)
+        self.reason = reason
+        self.error = error
+
+# average length of a year in days, including leap years
+DAYS_PER_YEAR = 365.25
+
+# columns dropped from the raw dataset
+COLS_TO_DROP = ['Rank','Acronym','Status',
+                'Sponsor/Collaborators','Locations','Funded Bys',
+                'Other IDs','Study Documents',
+                'URL','First Posted', 'Results First Posted', 'Last Update Posted']
+
+# new columns split from the multi-value column 'Study Designs'
+STUDY_DESIGN_COLS = ['Allocation','Intervention Model','Masking','Primary Purpose']
+
+# reason codes written to the quarantine file
+REASON_STUDY_DESIGNS = 'STUDY_DESIGNS_PARSE'
+REASON_INTERVENTIONS = 'INTERVENTIONS_PARSE'
+
+# quarantined records are rare, a large write buffer keeps them off the fast path
+QUARANTINE_BUFFER_SIZE = 64 * 1024
+
+# number of raw records handed to a worker process at a time
+CHUNK_SIZE = 1000
+
+# on/off options in config files, read as booleans (yes/no, true/false, 1/0, on/off)
+CONFIG_FLAGS = ('quiet', 'cache_stats')
+
+# default file names
+RAW_FILE = 'Raw_ClinicalTrial.csv'
+OUTPUT_FILE = 'Data_after_processing.csv' # also the input of Module 2
+QUARANTINE_FILE = 'Quarantined_records.csv'
+
+def build_header(raw_header):
+    """
+        Build the processed table header from the raw table header
         
-        for row in reader:
+        Parameters
+        ----------
+        raw_header: list
+            the raw table header
+            
+        Returns
+        -------
+        header: list
+            the processed table header
+        index_to_drop: list
+            indices of raw columns to drop in every row
+    """
+    index_to_drop = get_index(raw_header, COLS_TO_DROP)
+    header = drop_cols(list(raw_header),index_to_drop)
+    header = add_cols(header,STUDY_DESIGN_COLS)
+    header = add_cols(header,['Intervention Methods','Duration (yr)',
+                              'Duration (day)','Start Date (ordinal)'])
+    return header, index_to_drop
 
-            # print progress message after processing every 100 records
-            if counter == 100:
-                time.sleep(0.05) # slow down the progress for the user to glance through progress message
-                counter = 0
-                print("...{:.2f}% done, processed {} rows".format((processed_rows/10000)*100, processed_rows))
+def scrub_row(raw_row, header, index_to_drop):
+    """
+        Scrub a single study record, the raw row is left untouched
+        
+        Parameters
+        ----------
+        raw_row: list
+            a row in the raw table
+        header: list
+            the processed table header returned by build_header
+        index_to_drop: list
+            indices of raw columns to drop, returned by build_header
             
-            # get header, only execute once in the loop
-            if processed_rows == 0:
-                header += row         
-                counter += 1
-                processed_rows += 1
-                continue
+        Returns
+        -------
+        row: list or None
+            the processed row, None if the study record is not interventional
             
-            # drop and add new columns in the header, only execute once in the loop
-            if index_to_drop == []:
-                
-                # drop columns
-                print('''......Dropping columns\n''')
-                index_to_drop = get_index(header, ['Rank','Acronym','Status',
-                                                     'Sponsor/Collaborators','Locations','Funded Bys',
-                                                     'Other IDs','Study Documents',
-                                                   'URL','First Posted', 'Results First Posted', 'Last Update Posted'])
-                header = drop_cols(header,index_to_drop)
-                time.sleep(1) # pause a second for the user to read the process
-                
-                print("......Dropping study records\n")
-                time.sleep(1)
-                # break up columns with multi-value entries
-                print('''......Splitting column: 'Study Design'\n''')
-                cols_to_add = ['Allocation','Intervention Model',
-                'Masking','Primary Purpose']      
-                header = add_cols(header,cols_to_add)
-                time.sleep(1)
-                
-                print("......Adding column: 'Intervention Methods'\n")
-                header = add_cols(header,['Intervention Methods'])
-                time.sleep(1)
-                
-                print("......Computing and adding column: 'Duration (yr)'\n")
-                header = add_cols(header,['Duration (yr)'])
-                time.sleep(1)
-                
-                # write the header
-                spamwriter.writerow(header)
-                print("Total records to process: 10000")
-                print()
-                time.sleep(1)
-                
-                continue
+        Raises
+        ------
+        RecordRejected
+            if 'Study Designs' or 'Interventions' cannot be parsed
+    """
+    # drop columns in every row
+    row = drop_cols(list(raw_row),index_to_drop)
+    
+    # only keep study records of type 'Interventional', drop observational studies for now
+    if select_entry(row,header,'Study Type').strip() != 'Interventional':
+        return None
+    
+    # split a multi-value column 'Study Design' into new columns 'Allocation',
+    # 'intervention Model','Masking','Primary Purpose'
+    # while keeping the original column
+    try:
+        interventional_dict = split_multivalue_entry(row, header, 'Study Designs')
+    except (KeyError, IndexError) as e:
+        raise RecordRejected(REASON_STUDY_DESIGNS, e)
+    
+    for col in STUDY_DESIGN_COLS:
+        try:
+            row = insert_entry(row,header,col,'|'.join(interventional_dict[col]))
+        except KeyError:
+            pass # entry defaults to 'null' for any missing key or value
+    
+    # Add a new column 'Intervention Methods' based on 'Interventions'
+    # while keeping the original column
+    try:
+        intervention_methods = '|'.join(split_multivalue_entry(row,header,'Interventions').keys())
+    except (KeyError, IndexError) as e:
+        raise RecordRejected(REASON_INTERVENTIONS, e)
+    row = insert_entry(row,header,'Intervention Methods',intervention_methods)
+    
+    # Compute and add new columns 'Duration (yr)', 'Duration (day)' and 'Start Date (ordinal)'
+    try:
+        start_date = to_datetime(select_entry(row, header, 'Start Date'))
+        start_ordinal = start_date.toordinal() # days since January 1 of year 1
+    except ValueError:
+        start_date = None
+        start_ordinal = "null"
+    try:
+        completion_date = to_datetime(select_entry(row, header,'Completion Date'))
+        duration_day = (completion_date-start_date).days # get duration in days
+        duration_year = int(round(duration_day/DAYS_PER_YEAR)) # round to years
+    except (ValueError, TypeError):
+        # TypeError if the start date could not be parsed
+        duration_day = "null"
+        duration_year = "null"
 
-            # drop columns in every row
-            row = drop_cols(row,index_to_drop)
+    row = insert_entry(row,header,'Duration (yr)',duration_year)
+    row = insert_entry(row,header,'Duration (day)',duration_day)
+    row = insert_entry(row,header,'Start Date (ordinal)',start_ordinal)
+    return row
+
+def quarantine_header(raw_header):
+    """
+        Get the header of the quarantine file: reason code, exception class
+        and the raw table header
+    """
+    return ['Reason','Exception'] + list(raw_header)
+
+def quarantine_record(raw_row, rejected):
+    """
+        Build the quarantine file row for a rejected record
+        
+        Parameters
+        ----------
+        raw_row: list
+            the rejected row in the raw table
+        rejected: RecordRejected
+            the rejection raised by scrub_row
+               
+        Returns
+        -------
+        record: list
+            reason code, exception class and the raw row
+    """
+    return [rejected.reason, type(rejected.error).__name__] + list(raw_row)
+
+def scrub_chunk(chunk, header, index_to_drop):
+    """
+        Scrub a chunk of study records, this is the unit of work handed
+        to worker processes
+        
+        Parameters
+        ----------
+        chunk: list
+            rows in the raw table
+        header: list
+            the processed table header returned by build_header
+        index_to_drop: list
+            indices of raw columns to drop, returned by build_header
             
-            # only keep study records of type 'Interventional', drop observational studies for now
-            if select_entry(row,header,'Study Type').strip() != 'Interventional':
-                dropped_records += 1
-                processed_rows += 1
-                counter += 1
-                continue
+        Returns
+        -------
+        results: list
+            a (row, quarantined) tuple for every record in the chunk,
+            row is the processed row or None if the record is dropped,
+            quarantined is the quarantine record or None
+    """
+    results = []
+    for raw_row in chunk:
+        try:
+            results.append((scrub_row(raw_row, header, index_to_drop), None))
+        except RecordRejected as rejected:
+            results.append((None, quarantine_record(raw_row, rejected)))
+    return results
+
+def iter_chunks(rows, chunk_size):
+    """
+        Group rows into lists of at most chunk_size rows
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def scrub_rows(raw_rows, header, index_to_drop, workers=1, chunk_size=CHUNK_SIZE):
+    """
+        Scrub study records in chunks, in worker processes if workers > 1
+        
+        Parameters
+        ----------
+        raw_rows: iterable
+            rows in the raw table, without the header
+        header: list
+            the processed table header returned by build_header
+        index_to_drop: list
+            indices of raw columns to drop, returned by build_header
+        workers: int (Optional, defaults to 1)
+            number of worker processes
+        chunk_size: int (Optional, defaults to CHUNK_SIZE)
+            number of records handed to a worker at a time
             
-            # split a multi-value column 'Study Design' into new columns 'Allocation',
-            # 'intervention Model','Masking','Primary Purpose'
-            # while keeping the original column
-            try:
-                interventional_dict = split_multivalue_entry(row, header, 'Study Designs')
-            except:
-                dropped_records += 1
-                processed_rows += 1
-                counter += 1
-                continue 
+        Yields
+        ------
+        result: tuple
+            a (row, quarantined) tuple as returned by scrub_chunk,
+            in the order of the raw rows
+    """
+    scrub = partial(scrub_chunk, header=header, index_to_drop=index_to_drop)
+    chunks = iter_chunks(raw_rows, chunk_size)
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            for results in pool.imap(scrub, chunks):
+                yield from results
+    else:
+        for chunk in chunks:
+            yield from scrub(chunk)
+
+def shard_of(nct_number, num_shards):
+    """
+        Get the shard a study record belongs to. The 32-bit CRC of the
+        NCT Number is split into num_shards equal hash ranges, so every
+        machine assigns a record to the same shard.
+        
+        Parameters
+        ----------
+        nct_number: str
+            the NCT Number of a study record
+        num_shards: int
+            total number of shards
             
-    
-            try:
-                row = insert_entry(row,header,'Allocation','|'.join(interventional_dict['Allocation']))
-            except:
-                pass # entry defaults to 'null' for any missing key or value
-            try:
-                row = insert_entry(row,header,'Intervention Model','|'.join(interventional_dict['Intervention Model']))
-            except:
-                pass            
-            try:
-                row = insert_entry(row,header,'Masking','|'.join(interventional_dict['Masking']))
-            except:
-                pass                
-            try:
-                row = insert_entry(row,header,'Primary Purpose','|'.join(interventional_dict['Primary Purpose']))
-            except:
-                pass 
+        Returns
+        -------
+        shard_index: int
+            an integer in [0, num_shards)
+    """
+    return (zlib.crc32(nct_number.strip().encode('utf-8')) * num_shards) >> 32
+
+def parse_shard(value):
+    """
+        Parse a shard given on the command line as 'INDEX/COUNT', e.g. '0/4'
+        
+        Returns
+        -------
+        shard: tuple
+            shard index and total number of shards
+    """
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("shard must be INDEX/COUNT, e.g. 0/4")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError("shard index must be in [0, COUNT)")
+    return index, count
+
+def scrub_file(raw_file, quarantine, stats, workers=1, chunk_size=CHUNK_SIZE, shard=None):
+    """
+        Scrub the raw CSV file, writing rejected records to the quarantine file
+        
+        Parameters
+        ----------
+        raw_file: str
+            path of the raw CSV file
+        quarantine: str
+            path of the quarantine file
+        stats: dict
+            updated with the number of 'processed', 'dropped' and
+            'quarantined' records as the rows are consumed
+        workers: int (Optional, defaults to 1)
+            number of worker processes
+        chunk_size: int (Optional, defaults to CHUNK_SIZE)
+            number of records handed to a worker at a time
+        shard: tuple (Optional, defaults to None)
+            shard index and total number of shards, only records whose
+            NCT Number falls in that shard are scrubbed
             
-            # Add a new column 'Intervention Methods' based on 'Interventions'
-            # while keeping the original column
-            try:
-                intervention_methods = '|'.join(split_multivalue_entry(row,header,'Interventions').keys())
-                row = insert_entry(row,header,'Intervention Methods',intervention_methods)
-            except:
-                dropped_records += 1
-                processed_rows += 1
-                counter += 1
-                continue
+        Yields
+        ------
+        row: list
+            the processed table header first, then the processed rows
+    """
+    stats.update(processed=0, dropped=0, quarantined=0)
+    with open(raw_file,encoding='utf-8',errors='ignore') as f1, \
+         open(quarantine,'w',encoding='utf-8',newline='',buffering=QUARANTINE_BUFFER_SIZE) as f2:
+        reader = csv.reader(f1,delimiter=',')
+        q_writer = csv.writer(f2, delimiter=',')
+        raw_header = next(reader)
+        q_writer.writerow(quarantine_header(raw_header))
+        header, index_to_drop = build_header(raw_header)
+        yield header
+        
+        if shard is not None:
+            nct_index = raw_header.index('NCT Number')
+            reader = (row for row in reader if shard_of(row[nct_index], shard[1]) == shard[0])
+        
+        for row, quarantined in scrub_rows(reader, header, index_to_drop, workers, chunk_size):
+            stats['processed'] += 1
+            if quarantined is not None:
+                q_writer.writerow(quarantined)
+                stats['quarantined'] += 1
+                stats['dropped'] += 1
+            elif row is None:
+                stats['dropped'] += 1
+            else:
+                yield row
+
+def run_scrub(raw_file, output, quarantine, workers=1, chunk_size=CHUNK_SIZE, shard=None):
+    """
+        Scrub the raw CSV file without prompts or pauses. The output file is
+        replaced only once it is complete, so readers never see a partial file.
+        
+        Parameters
+        ----------
+        raw_file: str
+            path of the raw CSV file
+        output: str
+            path of the processed CSV file
+        quarantine: str
+            path of the quarantine file
+        workers: int (Optional, defaults to 1)
+            number of worker processes
+        chunk_size: int (Optional, defaults to CHUNK_SIZE)
+            number of records handed to a worker at a time
+        shard: tuple (Optional, defaults to None)
+            shard index and total number of shards to scrub, see shard_of
+            
+        Returns
+        -------
+        stats: dict
+            number of 'processed', 'dropped' and 'quarantined' records
+    """
+    stats = {}
+    tmp = output + '.tmp'
+    with open(tmp,'w',newline='') as f:
+        spamwriter = csv.writer(f, delimiter=',')
+        spamwriter.writerows(scrub_file(raw_file, quarantine, stats, workers, chunk_size, shard))
+    os.replace(tmp, output)
+    return stats
+
+def reprocess_quarantine(quarantine, output):
+    """
+        Rerun scrubbing on quarantined records only, e.g. after a parser fix.
+        Records that now pass are appended to the output file, the ones
+        still rejected are written back to the quarantine file. Both files are
+        written to temporary files first, and records already in the output
+        file are not appended again, so an interrupted run can simply be rerun.
+        
+        Parameters
+        ----------
+        quarantine: str
+            path of the quarantine file written by main
+        output: str
+            path of the processed CSV file to append recovered records to
             
-            # Compute and add a new column 'Duration (yr)'
+        Returns
+        -------
+        recovered: int
+            number of records recovered into the output file
+        remaining: int
+            number of records left in the quarantine file
+    """
+    with open(quarantine,encoding='utf-8',newline='') as f:
+        reader = csv.reader(f,delimiter=',')
+        q_header = next(reader)
+        records = list(reader)
+    
+    raw_header = q_header[2:]
+    header, index_to_drop = build_header(raw_header)
+    with open(output,newline='') as f:
+        output_header = next(csv.reader(f,delimiter=','), None)
+    if output_header != header:
+        raise ValueError("{} does not have the processed header of the records in {}".format(
+            output, quarantine))
+    
+    nct_index = header.index('NCT Number')
+    recovered = 0
+    remaining = 0
+    output_tmp = output + '.tmp'
+    quarantine_tmp = quarantine + '.tmp'
+    with open(output,newline='') as f1, open(output_tmp,'w',newline='') as f2, \
+         open(quarantine_tmp,'w',encoding='utf-8',newline='') as f3:
+        reader = csv.reader(f1,delimiter=',')
+        spamwriter = csv.writer(f2, delimiter=',')
+        q_writer = csv.writer(f3, delimiter=',')
+        
+        spamwriter.writerow(next(reader))
+        processed = set()
+        for row in reader:
+            processed.add(row[nct_index])
+            spamwriter.writerow(row)
+        
+        q_writer.writerow(q_header)
+        for record in records:
+            raw_row = record[2:]
             try:
-                start_date = to_datetime(select_entry(row, header, 'Start Date'))
-                completion_date = to_datetime(select_entry(row, header,'Completion Date'))
-                duration_day = (completion_date-start_date).days # get duration in days
-                duration_year = int(round(duration_day/30/12)) # round to years
-            except:
-                duration_year = "null"
-
-            row = insert_entry(row,header,'Duration (yr)',duration_year)
+                row = scrub_row(raw_row, header, index_to_drop)
+            except RecordRejected as rejected:
+                q_writer.writerow(quarantine_record(raw_row, rejected))
+                remaining += 1
+                continue
+            if row is not None:
+                # recovered by an earlier run that was interrupted
+                if row[nct_index] not in processed:
+                    spamwriter.writerow(row)
+                recovered += 1
+    
+    # replace the output first, rerunning after an interruption in between
+    # skips the records it already holds
+    os.replace(output_tmp, output)
+    os.replace(quarantine_tmp, quarantine)
+    return recovered, remaining
+
+def main():
+    output = OUTPUT_FILE
+    quarantine = QUARANTINE_FILE
+    stats = {}
+    rows = scrub_file(RAW_FILE, quarantine, stats)
+    with open(output,'w', newline='') as f:
+        spamwriter = csv.writer(f, delimiter=',')
+        header = next(rows)
+        
+        print('''......Dropping columns\n''')
+        time.sleep(1) # pause a second for the user to read the process
+        print("......Dropping study records\n")
+        time.sleep(1)
+        print('''......Splitting column: 'Study Design'\n''')
+        time.sleep(1)
+        print("......Adding column: 'Intervention Methods'\n")
+        time.sleep(1)
+        print("......Computing and adding columns: 'Duration (yr)', 'Duration (day)', 'Start Date (ordinal)'\n")
+        time.sleep(1)
+        
+        # write the header
+        spamwriter.writerow(header)
+        print("Total records to process: 10000")
+        print()
+        time.sleep(1)
+        
+        last_progress = 0
+        for row in rows:
             
-                
-            processed_rows += 1
-            counter += 1
+            # print progress message after processing every 100 records
+            if stats['processed'] - last_progress >= 100:
+                time.sleep(0.05) # slow down the progress for the user to glance through progress message
+                last_progress = stats['processed']
+                print("...{:.2f}% done, processed {} rows".format((last_progress/10000)*100, last_progress))
             
             # after processing a row, write it
             spamwriter.writerow(row)
+    
+    # after exiting for loop, print the last progress message, should be 100% done
+    print("...{:.2f}% done, processed {} rows".format((stats['processed']/10000)*100, stats['processed']))
+    print()
+    print('Total records dropped: '+str(stats['dropped']))
+    print('Records quarantined: '+str(stats['quarantined']))
+    print('Remaining records: '+str(stats['processed'] - stats['dropped']))
+    print('Please see output file: '+output)
+    print('Please see quarantine file: '+quarantine)
+
+def load_config(filename, sections):
+    """
+        Read option defaults from an INI config file
         
-        # after exiting for loop, print the last progress message, should be 100% done
-        print("...{:.2f}% done, processed {} rows".format((processed_rows/10000)*100, processed_rows))
-        print()
-        print('Total records dropped: '+str(dropped_records))
-        print('Remaining records: '+str(10000 - dropped_records))
-        print('Please see output file: '+output)
+        Parameters
+        ----------
+        filename: str
+            path of the config file
+        sections: list
+            sections to read, later sections override earlier ones
+            
+        Returns
+        -------
+        defaults: dict
+            option names (e.g. 'chunk_size') as keys to values as strings,
+            or as booleans for flags
+    """
+    config = configparser.ConfigParser(interpolation=None)
+    if not config.read(filename):
+        raise FileNotFoundError("config file not found: " + filename)
+    defaults = {}
+    for section in sections:
+        if config.has_section(section):
+            for key, value in config[section].items():
+                if key in CONFIG_FLAGS:
+                    defaults[key] = config.getboolean(section, key)
+                else:
+                    defaults[key] = value
+    return defaults
+
+def config_defaults(argv, sections):
+    """
+        Get option defaults from the config file given by --config, if any
+        
+        Parameters
+        ----------
+        argv: list
+            command line arguments
+        sections: list
+            config file sections to read
+            
+        Returns
+        -------
+        defaults: dict
+            option names as keys to default values
+    """
+    pre_parser = argparse.ArgumentParser(add_help=False)
+    pre_parser.add_argument('--config')
+    known, _ = pre_parser.parse_known_args(argv)
+    if known.config is None:
+        return {}
+    return load_config(known.config, sections)
+
+def add_scrub_arguments(parser, workers_help="number of worker processes"):
+    """
+        Add the scrubbing options to a command line parser
+    """
+    parser.add_argument('--raw', default=RAW_FILE,
+                        help="raw CSV file (default: %(default)s)")
+    parser.add_argument('--quarantine', default=QUARANTINE_FILE,
+                        help="quarantine file for rejected records (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help=workers_help + " (default: %(default)s)")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help="records handed to a worker at a time (default: %(default)s)")
+
+def build_parser(defaults):
+    """
+        Build the command line parser
+        
+        Parameters
+        ----------
+        defaults: dict
+            option defaults read from the config file
+            
+        Returns
+        -------
+        parser: argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(
+        description="Scrub the cancer clinical trial dataset. "
+                    "Run without a command for the step-by-step walkthrough.")
+    subparsers = parser.add_subparsers(dest='command')
+    
+    scrub = subparsers.add_parser('scrub',
+        help="scrub the raw dataset without prompts or pauses, e.g. from cron")
+    add_scrub_arguments(scrub)
+    scrub.add_argument('--output', default=OUTPUT_FILE,
+                       help="processed CSV file (default: %(default)s)")
+    scrub.add_argument('--shard', type=parse_shard,
+                       help="only scrub records in shard INDEX/COUNT of the NCT Number hash range")
+    scrub.add_argument('--quiet', action='store_true',
+                       help="do not print a summary")
+    
+    reprocess = subparsers.add_parser('reprocess',
+        help="rerun only the quarantined records after a parser fix")
+    reprocess.add_argument('--quarantine', default=QUARANTINE_FILE,
+                           help="quarantine file to rerun (default: %(default)s)")
+    reprocess.add_argument('--output', default=OUTPUT_FILE,
+                           help="processed CSV file to append to (default: %(default)s)")
+    
+    for subparser in (scrub, reprocess):
+        subparser.add_argument('--config',
+            help="INI file with option defaults in section [scrub]")
+        subparser.set_defaults(**defaults)
+    return parser
+
+def cli(argv=None):
+    """
+        The command line entry point of the program
+        
+        Parameters
+        ----------
+        argv: list (Optional, defaults to None)
+            command line arguments, sys.argv[1:] if not given
+            
+        Returns
+        -------
+        status: int
+            the exit status
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = build_parser(config_defaults(argv, ['scrub']))
+    args = parser.parse_args(argv)
+    
+    if args.command is None:
+        main()
+    elif args.command == 'scrub':
+        stats = run_scrub(args.raw, args.output, args.quarantine, args.workers, args.chunk_size, args.shard)
+        if not args.quiet:
+            print('Records processed: '+str(stats['processed']))
+            print('Total records dropped: '+str(stats['dropped']))
+            print('Records quarantined: '+str(stats['quarantined']))
+            print('Please see output file: '+args.output)
+    elif args.command == 'reprocess':
+        try:
+            recovered, remaining = reprocess_quarantine(args.quarantine, args.output)
+        except ValueError as error:
+            parser.error(str(error))
+        print('Records recovered: '+str(recovered))
+        print('Records still quarantined: '+str(remaining))
+        print('Please see output file: '+args.output)
+    return 0
  
 if __name__ == "__main__":
-    main()
+    sys.exit(cli())
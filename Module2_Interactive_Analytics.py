@@ -3,9 +3,12 @@
 """
 Created on Sun Sep 30 08:28:52 2018
 
-This program supports two functionalities:
+This program supports five functionalities:
 * Plotting horizontal bar charts
 * Plotting heatmaps
+* Listing the top cancers by number of trials
+* Listing cancers with at least N trials by average trial duration
+* Listing trials started per year with a rolling average trial duration
 
 It is user interactive. The user can choose from the engines and 
 a list of cancers to generate visualization based on a preprocessed 
@@ -34,19 +37,91 @@ Overview of dataset:
 * Primary Purpose
 * Intervention Methods
 * Duration (yr)
+* Duration (day)
+* Start Date (ordinal)
+
+Run without arguments for the interactive program. For batch runs,
+e.g. from cron, use one of the non-interactive commands:
+
+    python Module2_Interactive_Analytics.py render --engine heatmap --format svg
+    python Module2_Interactive_Analytics.py pipeline --raw Raw.csv --engine top --format csv
+
+'pipeline' scrubs the raw dataset with Module 1 and passes it to the engine
+in memory, without writing the processed CSV file. Options can also be read
+from an INI file with --config (sections [scrub] and [analytics]).
+
+For datasets too large for one machine, 'shard --shard I/N' scrubs the
+records in one NCT Number hash range and writes a partial aggregate,
+'merge' combines the partial aggregates into the exact global metrics and
+'render --aggregate' charts them. 'sharded' runs all shards in local
+processes as a stand-in for separate machines.
+
+The metrics of the processed file are cached in memory, keyed by a
+fingerprint of the file, and optionally on disk (configure_cache,
+'render --cache-dir'); cache_info() reports hits and misses.
 
 Note: Please install/UPDATE all packages required to run the program
 
 @author: Melody
 """
+import argparse
+import copy
 import csv
+import datetime
+import functools
+import hashlib
+import heapq
+import inspect
+import json
+import multiprocessing
+import os
+import pickle
+import sys
+from bisect import bisect_left
+from collections import OrderedDict
+from operator import itemgetter
 import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+import Module1_Data_Scrubbing as scrubbing
+
 matplotlib.style.use('ggplot') # look pretty
 
+# the processed CSV file written by Module 1
+DATA_FILE = scrubbing.OUTPUT_FILE
+
+# cancers charted when no selection is given
+DEFAULT_CANCERS = ('Breast Cancer','Pancreatic Cancer','Lung Cancer','Colon Cancer',
+                   'Bladder Cancer','Liver Cancer','Brain Cancer','Skin Cancer','Prostate Cancer',
+                   'Colorectal Cancer','Head and Neck Cancer','Ovarian Cancer')
+
+# percentiles of the per-cancer average trial durations, drawn on the bar chart
+REFERENCE_PERCENTILES = [25, 50, 75]
+
+# heatmaps with more rows than this are drawn without cell annotations
+MAX_ANNOTATED_ROWS = 50
+
+# blocks hashed at evenly spaced offsets to fingerprint the processed file
+FINGERPRINT_SAMPLES = 16
+FINGERPRINT_BLOCK_SIZE = 4096
+
+# part of every cache key, bump it whenever a cached function changes
+# so that results pickled by older code are not served
+CACHE_VERSION = 1
+
+# state of the metric cache, see cached_metric
+_metric_cache = {'entries': OrderedDict(), 'maxsize': 32, 'directory': None,
+                 'hits': 0, 'disk_hits': 0, 'misses': 0}
+
+# engines for batch runs, with the output formats they support, default first
+ENGINE_FORMATS = {'hbar': ['png','pdf','svg'],
+                  'heatmap': ['png','pdf','svg'],
+                  'top': ['text','csv'],
+                  'duration': ['text','csv'],
+                  'cohort': ['text','csv']}
+
 
 def select_entry(row, header, feature):
     """
@@ -88,43 +163,241 @@ def compute_average(num_list):
         sum += int(num)
         count += 1
     return sum/count
-def cancer_to_average_duration(): 
+
+def read_table(filename=DATA_FILE):
+    """
+        Read the processed CSV file into memory, so that it is read once
+        for all metrics
+        
+        Parameters
+        ----------
+        filename: str (Optional, defaults to DATA_FILE)
+            path of the processed CSV file
+               
+        Returns
+        -------
+        table: tuple
+            the table header and a list of rows
+    """
+    with open(filename,encoding='utf-8',errors='ignore') as f:
+        reader = csv.reader(f,delimiter=',')
+        header = next(reader)
+        rows = list(reader)
+    return header, rows
+
+def dataset_fingerprint(filename):
+    """
+        Fingerprint a file by its size, modification time and a hash of
+        FINGERPRINT_SAMPLES blocks sampled across it, without reading it all
+        
+        Parameters
+        ----------
+        filename: str
+            path of the file
+            
+        Returns
+        -------
+        fingerprint: str
+    """
+    stat = os.stat(filename)
+    digest = hashlib.sha1('{}:{}'.format(stat.st_size, stat.st_mtime_ns).encode('utf-8'))
+    with open(filename,'rb') as f:
+        if stat.st_size <= FINGERPRINT_SAMPLES * FINGERPRINT_BLOCK_SIZE:
+            digest.update(f.read())
+        else:
+            last_offset = stat.st_size - FINGERPRINT_BLOCK_SIZE
+            for i in range(FINGERPRINT_SAMPLES):
+                f.seek(i * last_offset // (FINGERPRINT_SAMPLES - 1))
+                digest.update(f.read(FINGERPRINT_BLOCK_SIZE))
+    return digest.hexdigest()
+
+def configure_cache(maxsize=None, directory=None):
+    """
+        Configure the metric cache
+        
+        Parameters
+        ----------
+        maxsize: int (Optional, defaults to None)
+            number of results kept in memory, unchanged if not given
+        directory: str (Optional, defaults to None)
+            directory to also keep results in as pickle files, so that they
+            survive across sessions, unchanged if not given
+    """
+    if maxsize is not None:
+        _metric_cache['maxsize'] = maxsize
+        while len(_metric_cache['entries']) > maxsize:
+            _metric_cache['entries'].popitem(last=False)
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+        _metric_cache['directory'] = directory
+
+def cache_info():
+    """
+        Get hit and miss statistics of the metric cache
+        
+        Returns
+        -------
+        info: dict
+            'hits': results served from memory
+            'disk_hits': results served from the cache directory
+            'misses': results computed
+            'size', 'maxsize': results in memory and their limit
+            'directory': the cache directory, None if results are only kept in memory
+    """
+    return {'hits': _metric_cache['hits'], 'disk_hits': _metric_cache['disk_hits'],
+            'misses': _metric_cache['misses'], 'size': len(_metric_cache['entries']),
+            'maxsize': _metric_cache['maxsize'], 'directory': _metric_cache['directory']}
+
+def clear_cache(disk=False):
+    """
+        Empty the metric cache and reset its statistics
+        
+        Parameters
+        ----------
+        disk: bool (Optional, defaults to False)
+            whether to also delete the files in the cache directory
+    """
+    _metric_cache['entries'].clear()
+    _metric_cache.update(hits=0, disk_hits=0, misses=0)
+    directory = _metric_cache['directory']
+    if disk and directory is not None:
+        for name in os.listdir(directory):
+            if name.endswith('.pkl'):
+                os.remove(os.path.join(directory, name))
+
+def write_cache_file(path, prefix, result):
+    """
+        Pickle a result into the cache directory and remove the files of the
+        same function and arguments cached for older fingerprints. Errors are
+        ignored, the result is then computed again next time.
+        
+        Parameters
+        ----------
+        path: str
+            path of the cache file
+        prefix: str
+            file name prefix shared by the cache files of the same call
+        result: object
+            the result to cache
+    """
+    tmp = path + '.tmp'
+    try:
+        with open(tmp,'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except (OSError, pickle.PicklingError):
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return
+    
+    directory, name = os.path.split(path)
+    try:
+        stale = [other for other in os.listdir(directory)
+                 if other.startswith(prefix) and other != name]
+        for other in stale:
+            os.remove(os.path.join(directory, other))
+    except OSError:
+        pass # another process removed it first, or the directory is read-only
+
+def cached_metric(func):
+    """
+        Memoize a function of the processed CSV file in an in-memory LRU and,
+        if configured, in the cache directory. Results are keyed by CACHE_VERSION,
+        the function, its arguments and the fingerprint of the file, so a changed
+        file is never served stale results. Calls given an in-memory table are
+        not cached. Every call returns its own copy of the cached result, so
+        callers may modify it.
+        
+        The cache directory keeps one file per function and arguments: writing
+        a result removes the files of older fingerprints or versions. Failing
+        to write the cache directory only costs the result being recomputed.
+    """
+    signature = inspect.signature(func)
+    
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        if arguments.pop('table', None) is not None:
+            return func(*args, **kwargs)
+        
+        filename = arguments.get('filename', DATA_FILE)
+        call = func.__name__, sorted(arguments.items())
+        key = hashlib.sha1(pickle.dumps((CACHE_VERSION, call, dataset_fingerprint(filename)))).hexdigest()
+        entries = _metric_cache['entries']
+        if key in entries:
+            _metric_cache['hits'] += 1
+            entries.move_to_end(key)
+            return copy.deepcopy(entries[key])
+        
+        directory = _metric_cache['directory']
+        path = None
+        on_disk = False
+        if directory is not None:
+            prefix = func.__name__ + '-' + hashlib.sha1(pickle.dumps(call)).hexdigest()[:16] + '-'
+            path = os.path.join(directory, prefix + key + '.pkl')
+            try:
+                with open(path,'rb') as f:
+                    result = pickle.load(f)
+                on_disk = True
+            except (OSError, pickle.UnpicklingError, EOFError):
+                pass # not cached yet, or an unreadable file that is rewritten below
+        
+        if on_disk:
+            _metric_cache['disk_hits'] += 1
+        else:
+            _metric_cache['misses'] += 1
+            result = func(*args, **kwargs)
+            if path is not None:
+                write_cache_file(path, prefix, result)
+        
+        entries[key] = result
+        if len(entries) > _metric_cache['maxsize']:
+            entries.popitem(last=False)
+        return copy.deepcopy(result)
+    return wrapper
+
+@cached_metric
+def cancer_to_average_duration(table=None):
     """
         Get average trial duration in years grouped by cancer type in the dataset
 
+        Parameters
+        ----------
+        table: tuple (Optional, defaults to None)
+            the table header and rows returned by read_table,
+            the processed CSV file is read if not given
+
         Returns
         -------
         cancer_to_duration: dict
             a dictionary of cancer type as keys to average trial duration as values
     """
-    with open('Data_after_processing.csv',encoding='utf-8',errors='ignore') as f:
-        reader = csv.reader(f,delimiter=',')
-        header = []
-        get_header = True
-        cancer_to_duration = {}
-        for row in reader:
-            # get header, only execute once in the loop
-            if get_header:
-                header += row
-                get_header = False
-                continue
-            conditions, duration = select_entry(row, header, 'Conditions'),select_entry(row, header, 'Duration (yr)')
-            if duration == 'null':
-                continue
-            
-            # split, get duration as a list if there are multiple conditions in an entry
-            if '|' in conditions:
-                for condition in conditions.split('|'):
-                    if condition.strip() not in cancer_to_duration:
-                        cancer_to_duration[condition.strip()] = [duration]
-                    else:
-                        cancer_to_duration[condition.strip()].append(duration)
-            else:
-                if conditions.strip() not in cancer_to_duration:
-                    cancer_to_duration[conditions.strip()] = [duration]
+    if table is None:
+        table = read_table()
+    header, rows = table
+    cancer_to_duration = {}
+    for row in rows:
+        conditions, duration = select_entry(row, header, 'Conditions'),select_entry(row, header, 'Duration (yr)')
+        if duration == 'null':
+            continue
+        
+        # split, get duration as a list if there are multiple conditions in an entry
+        if '|' in conditions:
+            for condition in conditions.split('|'):
+                if condition.strip() not in cancer_to_duration:
+                    cancer_to_duration[condition.strip()] = [duration]
                 else:
-                    cancer_to_duration[conditions.strip()].append(duration)
-                    
+                    cancer_to_duration[condition.strip()].append(duration)
+        else:
+            if conditions.strip() not in cancer_to_duration:
+                cancer_to_duration[conditions.strip()] = [duration]
+            else:
+                cancer_to_duration[conditions.strip()].append(duration)
+                
     # compute the average duration for each cancer
     for key in cancer_to_duration:
         average = compute_average(cancer_to_duration[key])
@@ -132,42 +405,44 @@ def cancer_to_average_duration():
     return cancer_to_duration
         
         
-def cancer_to_frequency(): 
+@cached_metric
+def cancer_to_frequency(table=None):
     """
         Count study records grouped by cancer type
 
+        Parameters
+        ----------
+        table: tuple (Optional, defaults to None)
+            the table header and rows returned by read_table,
+            the processed CSV file is read if not given
+
         Returns
         -------
         cancer_to_frequency: dict
             a dictionary of cancer type as keys to number of trials as values
     """
-    with open('Data_after_processing.csv',encoding='utf-8',errors='ignore') as f:
-        reader = csv.reader(f,delimiter=',')
-        header = []
-        get_header = True
-        cancer_to_frequency = {}
-        for row in reader:
-            if get_header:
-                header += row
-                get_header = False
-                continue
-            conditions = select_entry(row, header, 'Conditions')
-            
-            # split, count records if there are multiple conditions in an entry
-            if '|' in conditions:
-                for condition in conditions.split('|'):
-                    if condition.strip() not in cancer_to_frequency:
-                        cancer_to_frequency[condition.strip()] = 1
-                    else:
-                        cancer_to_frequency[condition.strip()] += 1
-            else:
-                if conditions.strip() not in cancer_to_frequency:
-                    cancer_to_frequency[conditions.strip()] = 1
+    if table is None:
+        table = read_table()
+    header, rows = table
+    cancer_to_frequency = {}
+    for row in rows:
+        conditions = select_entry(row, header, 'Conditions')
+        
+        # split, count records if there are multiple conditions in an entry
+        if '|' in conditions:
+            for condition in conditions.split('|'):
+                if condition.strip() not in cancer_to_frequency:
+                    cancer_to_frequency[condition.strip()] = 1
                 else:
-                    cancer_to_frequency[conditions.strip()] += 1
+                    cancer_to_frequency[condition.strip()] += 1
+        else:
+            if conditions.strip() not in cancer_to_frequency:
+                cancer_to_frequency[conditions.strip()] = 1
+            else:
+                cancer_to_frequency[conditions.strip()] += 1
     return cancer_to_frequency
 
-def cancer_to_intervention_percentage(cancer_count):
+def cancer_to_intervention_percentage(cancer_count, table=None):
     """
         Get cancer to intervention methods to intervention utilization
         
@@ -175,6 +450,9 @@ def cancer_to_intervention_percentage(cancer_count):
         ----------
         cancer_count: dict
             a dictionary returned by calling cancer_to_frequency
+        table: tuple (Optional, defaults to None)
+            the table header and rows returned by read_table,
+            the processed CSV file is read if not given
             
         Returns
         -------
@@ -184,66 +462,60 @@ def cancer_to_intervention_percentage(cancer_count):
                 Intervention Methods being the second layer keys
                 Intervention utilization(percentage) grouped by cancer and intervention methods as values
     """
-    with open('Data_after_processing.csv',encoding='utf-8',errors='ignore') as f:
-        reader = csv.reader(f,delimiter=',')
-        header = []
-        get_header = True
-        cancer_to_intervention_percentage = {}
-        
-        # make a copy of cancer to frequency, update later to be cancer to intervention methods
-        cancer_count_copy = cancer_count.copy() 
-        for key in cancer_count_copy:
-            # clear the original value, substituted by an empty dictionary
-            cancer_count_copy[key] = {}
-            
-        for row in reader:
-            # get header, only execute once in the loop
-            if get_header:
-                header += row
-                get_header = False
-                continue           
-            conditions, interventions = select_entry(row, header, 'Conditions'),select_entry(row, header, 'Intervention Methods')
-            
-            # split if the entry has multiple conditions
-            if '|' in conditions:    
-                for condition in conditions.split('|'):
-                    condition = condition.strip()
-                    
-                    # split if the entry has multiple interventions,
-                    # get number of each intervention utilized for a certain cancer
-                    if '|' in interventions:
-                        for intervention in interventions.split("|"):
-                            intervention = intervention.strip()
-                            if intervention in cancer_count_copy[condition]:
-                                cancer_count_copy[condition][intervention] += 1
-
-                            else:
-                                cancer_count_copy[condition][intervention] = 1   
-
-                    else:
-                        intervention = interventions.strip()
-                        if intervention in cancer_count_copy[condition]:
-                            cancer_count_copy[condition][intervention] += 1
-                        else:
-                            cancer_count_copy[condition][intervention] = 1
-           
-            else:
-                condition = conditions.strip()
+    if table is None:
+        table = read_table()
+    header, rows = table
+    cancer_to_intervention_percentage = {}
+    
+    # make a copy of cancer to frequency, update later to be cancer to intervention methods
+    cancer_count_copy = cancer_count.copy() 
+    for key in cancer_count_copy:
+        # clear the original value, substituted by an empty dictionary
+        cancer_count_copy[key] = {}
+        
+    for row in rows:
+        conditions, interventions = select_entry(row, header, 'Conditions'),select_entry(row, header, 'Intervention Methods')
+        
+        # split if the entry has multiple conditions
+        if '|' in conditions:    
+            for condition in conditions.split('|'):
+                condition = condition.strip()
+                
+                # split if the entry has multiple interventions,
+                # get number of each intervention utilized for a certain cancer
                 if '|' in interventions:
                     for intervention in interventions.split("|"):
-                        #print(intervention)
                         intervention = intervention.strip()
                         if intervention in cancer_count_copy[condition]:
                             cancer_count_copy[condition][intervention] += 1
+
                         else:
-                            cancer_count_copy[condition][intervention] = 1                        
+                            cancer_count_copy[condition][intervention] = 1   
+
                 else:
                     intervention = interventions.strip()
                     if intervention in cancer_count_copy[condition]:
                         cancer_count_copy[condition][intervention] += 1
                     else:
                         cancer_count_copy[condition][intervention] = 1
-    
+       
+        else:
+            condition = conditions.strip()
+            if '|' in interventions:
+                for intervention in interventions.split("|"):
+                    #print(intervention)
+                    intervention = intervention.strip()
+                    if intervention in cancer_count_copy[condition]:
+                        cancer_count_copy[condition][intervention] += 1
+                    else:
+                        cancer_count_copy[condition][intervention] = 1                        
+            else:
+                intervention = interventions.strip()
+                if intervention in cancer_count_copy[condition]:
+                    cancer_count_copy[condition][intervention] += 1
+                else:
+                    cancer_count_copy[condition][intervention] = 1
+
     # make a copy of cancer to intervention methods to count dictionary
     # update later to get cancer to intervention percentage
     cancer_to_intervention_percentage = cancer_count_copy.copy()
@@ -257,7 +529,797 @@ def cancer_to_intervention_percentage(cancer_count):
     return cancer_to_intervention_percentage
 
 
-def draw_hbar(choice_of_cancers=None):
+def aggregate_table(table):
+    """
+        Compute a partial aggregate of the dataset, from which the metrics can
+        be derived exactly. Partial aggregates of disjoint shards of the
+        dataset are combined with merge_aggregates.
+        
+        Parameters
+        ----------
+        table: tuple
+            the table header and rows returned by read_table
+            
+        Returns
+        -------
+        aggregate: dict
+            'frequency': cancer type to number of trials
+            'duration_sum': cancer type to sum of trial durations
+            'duration_count': cancer type to number of trials with a duration
+            'interventions': cancer type to intervention method to number of uses
+    """
+    header, rows = table
+    frequency = {}
+    duration_sum = {}
+    duration_count = {}
+    interventions = {}
+    for row in rows:
+        conditions = select_entry(row, header, 'Conditions')
+        duration = select_entry(row, header, 'Duration (yr)')
+        methods = [method.strip() for method in select_entry(row, header, 'Intervention Methods').split('|')]
+        for condition in conditions.split('|'):
+            condition = condition.strip()
+            frequency[condition] = frequency.get(condition, 0) + 1
+            if duration != 'null':
+                duration_sum[condition] = duration_sum.get(condition, 0) + int(duration)
+                duration_count[condition] = duration_count.get(condition, 0) + 1
+            method_count = interventions.setdefault(condition, {})
+            for method in methods:
+                method_count[method] = method_count.get(method, 0) + 1
+    return {'frequency': frequency, 'duration_sum': duration_sum,
+            'duration_count': duration_count, 'interventions': interventions}
+
+def merge_aggregates(aggregates):
+    """
+        Combine partial aggregates of disjoint shards of the dataset
+        
+        Parameters
+        ----------
+        aggregates: list
+            dictionaries returned by aggregate_table or load_aggregate
+            
+        Returns
+        -------
+        aggregate: dict
+            the aggregate of the whole dataset
+    """
+    merged = {'frequency': {}, 'duration_sum': {}, 'duration_count': {}, 'interventions': {}}
+    for aggregate in aggregates:
+        for key in ['frequency', 'duration_sum', 'duration_count']:
+            for condition, value in aggregate[key].items():
+                merged[key][condition] = merged[key].get(condition, 0) + value
+        for condition, method_count in aggregate['interventions'].items():
+            merged_count = merged['interventions'].setdefault(condition, {})
+            for method, count in method_count.items():
+                merged_count[method] = merged_count.get(method, 0) + count
+    return merged
+
+def aggregate_to_frequency(aggregate):
+    """
+        Get the same result as cancer_to_frequency from an aggregate
+    """
+    return dict(aggregate['frequency'])
+
+def aggregate_to_average_duration(aggregate):
+    """
+        Get the same result as cancer_to_average_duration from an aggregate
+    """
+    duration_count = aggregate['duration_count']
+    return {condition: total/duration_count[condition]
+            for condition, total in aggregate['duration_sum'].items()}
+
+def save_aggregate(aggregate, filename):
+    """
+        Serialize an aggregate to a JSON file
+    """
+    tmp = filename + '.tmp'
+    with open(tmp,'w',encoding='utf-8') as f:
+        json.dump(aggregate, f)
+    os.replace(tmp, filename)
+
+def load_aggregate(filename):
+    """
+        Read an aggregate written by save_aggregate
+    """
+    with open(filename,encoding='utf-8') as f:
+        return json.load(f)
+
+def shard_file_names(shard, output_dir='.', quarantine=scrubbing.QUARANTINE_FILE):
+    """
+        Get the file names a shard run writes to
+        
+        Parameters
+        ----------
+        shard: tuple
+            shard index and total number of shards
+        output_dir: str (Optional, defaults to '.')
+            directory to write the files to
+        quarantine: str (Optional, defaults to scrubbing.QUARANTINE_FILE)
+            quarantine file name the shard suffix is added to
+            
+        Returns
+        -------
+        names: tuple
+            paths of the processed CSV, quarantine and aggregate files
+    """
+    suffix = '.shard{}of{}'.format(*shard)
+    names = []
+    for filename in (DATA_FILE, quarantine, 'Aggregate.json'):
+        root, ext = os.path.splitext(os.path.basename(filename))
+        names.append(os.path.join(output_dir, root + suffix + ext))
+    return tuple(names)
+
+def run_shard(raw_file, shard, output_dir='.', workers=1, chunk_size=scrubbing.CHUNK_SIZE,
+              quarantine=scrubbing.QUARANTINE_FILE):
+    """
+        Scrub one shard of the raw dataset, then write its processed CSV file
+        and its partial aggregate
+        
+        Parameters
+        ----------
+        raw_file: str
+            path of the raw CSV file
+        shard: tuple
+            shard index and total number of shards, see scrubbing.shard_of
+        output_dir: str (Optional, defaults to '.')
+            directory to write the files to
+        workers: int (Optional, defaults to 1)
+            number of worker processes for scrubbing
+        chunk_size: int (Optional, defaults to scrubbing.CHUNK_SIZE)
+            number of records handed to a worker at a time
+        quarantine: str (Optional, defaults to scrubbing.QUARANTINE_FILE)
+            quarantine file name, written per shard, see shard_file_names
+            
+        Returns
+        -------
+        aggregate_file: str
+            path of the partial aggregate file
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    output, quarantine, aggregate_file = shard_file_names(shard, output_dir, quarantine)
+    stats = {}
+    rows = scrubbing.scrub_file(raw_file, quarantine, stats, workers, chunk_size, shard)
+    header = next(rows)
+    rows = list(rows)
+    
+    tmp = output + '.tmp'
+    with open(tmp,'w',newline='') as f:
+        writer = csv.writer(f, delimiter=',')
+        writer.writerow(header)
+        writer.writerows(rows)
+    os.replace(tmp, output)
+    save_aggregate(aggregate_table((header, rows)), aggregate_file)
+    return aggregate_file
+
+def run_shards_locally(raw_file, num_shards, output_dir='.', workers=1, chunk_size=scrubbing.CHUNK_SIZE,
+                       quarantine=scrubbing.QUARANTINE_FILE):
+    """
+        Run every shard in its own process, as a stand-in for running them
+        on separate machines, then merge their partial aggregates
+        
+        Parameters
+        ----------
+        raw_file: str
+            path of the raw CSV file
+        num_shards: int
+            total number of shards
+        output_dir: str (Optional, defaults to '.')
+            directory to write the shard files to
+        workers: int (Optional, defaults to 1)
+            number of shards run at the same time
+        chunk_size: int (Optional, defaults to scrubbing.CHUNK_SIZE)
+            number of records handed to a worker at a time
+        quarantine: str (Optional, defaults to scrubbing.QUARANTINE_FILE)
+            quarantine file name, written per shard, see shard_file_names
+            
+        Returns
+        -------
+        aggregate: dict
+            the aggregate of the whole dataset
+    """
+    tasks = [(raw_file, (index, num_shards), output_dir, 1, chunk_size, quarantine)
+             for index in range(num_shards)]
+    with multiprocessing.Pool(workers) as pool:
+        aggregate_files = pool.starmap(run_shard, tasks)
+    return merge_aggregates(load_aggregate(filename) for filename in aggregate_files)
+
+def build_aggregate_store(aggregate):
+    """
+        Lay out an aggregate as NumPy arrays indexed by integer cancer IDs,
+        so that chart data for any selection of cancers is pulled by fancy
+        indexing instead of Python loops
+        
+        Parameters
+        ----------
+        aggregate: dict
+            a dictionary returned by aggregate_table or merge_aggregates
+            
+        Returns
+        -------
+        store: dict
+            'cancers': list of cancer types, position is the cancer ID
+            'cancer_index': cancer type to cancer ID
+            'interventions': list of intervention methods, position is the method ID
+            'intervention_index': intervention method to method ID
+            'frequency': array of number of trials per cancer ID
+            'average_duration': array of average trial duration per cancer ID,
+                NaN for cancers without any duration
+            'intervention_percentage': 2d array of intervention utilization,
+                cancer ID by method ID, with an extra last column of zeros
+                that unknown methods (ID -1) select
+            'duration_reference': 'mean' and 'percentiles' of the average
+                trial duration of all cancers, each cancer counted once however
+                many trials it has, see REFERENCE_PERCENTILES
+    """
+    cancers = list(aggregate['frequency'])
+    cancer_index = {cancer: i for i, cancer in enumerate(cancers)}
+    interventions = sorted({method for method_count in aggregate['interventions'].values()
+                            for method in method_count})
+    intervention_index = {method: i for i, method in enumerate(interventions)}
+    n = len(cancers)
+    
+    frequency = np.fromiter(aggregate['frequency'].values(), dtype=np.int64, count=n)
+    
+    duration_ids = np.fromiter((cancer_index[cancer] for cancer in aggregate['duration_sum']),
+                               dtype=np.intp, count=len(aggregate['duration_sum']))
+    duration_sum = np.zeros(n)
+    duration_count = np.zeros(n)
+    duration_sum[duration_ids] = list(aggregate['duration_sum'].values())
+    duration_count[duration_ids] = [aggregate['duration_count'][cancer] for cancer in aggregate['duration_sum']]
+    average_duration = np.divide(duration_sum, duration_count,
+                                 out=np.full(n, np.nan), where=duration_count > 0)
+    
+    # scatter the sparse counts into a dense matrix in one step
+    rows, cols, counts = [], [], []
+    for cancer, method_count in aggregate['interventions'].items():
+        for method, count in method_count.items():
+            rows.append(cancer_index[cancer])
+            cols.append(intervention_index[method])
+            counts.append(count)
+    intervention_count = np.zeros((n, len(interventions) + 1))
+    intervention_count[rows, cols] = counts
+    intervention_percentage = intervention_count / frequency[:, None]
+    
+    known_duration = average_duration[~np.isnan(average_duration)]
+    if known_duration.size:
+        duration_reference = {'mean': known_duration.mean(),
+                              'percentiles': dict(zip(REFERENCE_PERCENTILES,
+                                                      np.percentile(known_duration, REFERENCE_PERCENTILES)))}
+    else:
+        duration_reference = {'mean': np.nan,
+                              'percentiles': {q: np.nan for q in REFERENCE_PERCENTILES}}
+    
+    return {'cancers': cancers, 'cancer_index': cancer_index,
+            'interventions': interventions, 'intervention_index': intervention_index,
+            'frequency': frequency, 'average_duration': average_duration,
+            'intervention_percentage': intervention_percentage,
+            'duration_reference': duration_reference}
+
+@cached_metric
+def aggregate_file(filename=DATA_FILE):
+    """
+        Compute the aggregate of a processed CSV file, see aggregate_table
+        
+        Parameters
+        ----------
+        filename: str (Optional, defaults to DATA_FILE)
+            path of the processed CSV file
+            
+        Returns
+        -------
+        aggregate: dict
+    """
+    return aggregate_table(read_table(filename))
+
+@cached_metric
+def store_file(filename=DATA_FILE):
+    """
+        Build the aggregate store of a processed CSV file once, including its
+        intervention matrix and reference statistics, see build_aggregate_store
+    """
+    return build_aggregate_store(aggregate_file(filename))
+
+def load_store(table=None):
+    """
+        Build the aggregate store of the processed dataset
+        
+        Parameters
+        ----------
+        table: tuple (Optional, defaults to None)
+            the table header and rows returned by read_table,
+            the processed CSV file is read if not given
+               
+        Returns
+        -------
+        store: dict
+            a dictionary returned by build_aggregate_store
+    """
+    if table is None:
+        return store_file()
+    return build_aggregate_store(aggregate_table(table))
+
+def cancer_ids(store, cancers):
+    """
+        Get the integer IDs of cancer types in an aggregate store
+        
+        Parameters
+        ----------
+        store: dict
+            a dictionary returned by build_aggregate_store
+        cancers: list
+            cancer types
+            
+        Returns
+        -------
+        ids: numpy array
+            cancer IDs, raises KeyError for cancer types not in the dataset
+    """
+    cancer_index = store['cancer_index']
+    return np.fromiter((cancer_index[cancer] for cancer in cancers), dtype=np.intp, count=len(cancers))
+
+def intervention_ids(store, interventions):
+    """
+        Get the integer IDs of intervention methods in an aggregate store,
+        -1 for methods not in the dataset
+    """
+    intervention_index = store['intervention_index']
+    return np.fromiter((intervention_index.get(method, -1) for method in interventions),
+                       dtype=np.intp, count=len(interventions))
+
+def intervention_matrix(store, ids, interventions):
+    """
+        Get intervention utilization for a selection of cancers
+        
+        Parameters
+        ----------
+        store: dict
+            a dictionary returned by build_aggregate_store
+        ids: numpy array
+            cancer IDs returned by cancer_ids
+        interventions: list
+            intervention methods, the columns of the matrix
+            
+        Returns
+        -------
+        percentage_array: numpy array
+            2d array of intervention utilization, cancer by method,
+            0 where a method is not used for a cancer
+    """
+    return store['intervention_percentage'][np.ix_(ids, intervention_ids(store, interventions))]
+
+def top_k_by_frequency(cancer_count, k):
+    """
+        Get the k cancer types with the most trials, using a heap instead of
+        sorting all cancer types
+        
+        Parameters
+        ----------
+        cancer_count: dict
+            a dictionary returned by calling cancer_to_frequency
+        k: int
+            number of cancer types to return
+            
+        Returns
+        -------
+        top_k: list
+            a list of (cancer type, number of trials) tuples, most trials first
+    """
+    return heapq.nlargest(k, cancer_count.items(), key=itemgetter(1))
+
+def build_frequency_index(cancer_count):
+    """
+        Build a sorted index over the number of trials per cancer type,
+        so that frequency-threshold queries are answered by binary search
+        
+        Parameters
+        ----------
+        cancer_count: dict
+            a dictionary returned by calling cancer_to_frequency
+            
+        Returns
+        -------
+        frequency_index: tuple
+            a list of numbers of trials in ascending order and
+            a list of cancer types in the same order
+    """
+    ordered = sorted(cancer_count.items(), key=itemgetter(1))
+    frequencies = [count for cancer, count in ordered]
+    cancers = [cancer for cancer, count in ordered]
+    return frequencies, cancers
+
+def conditions_with_min_frequency(frequency_index, min_trials):
+    """
+        Get cancer types with at least a certain number of trials
+        
+        Parameters
+        ----------
+        frequency_index: tuple
+            a tuple returned by calling build_frequency_index
+        min_trials: int
+            the minimum number of trials
+            
+        Returns
+        -------
+        cancers: list
+            a list of cancer types, in ascending order of number of trials
+    """
+    frequencies, cancers = frequency_index
+    return cancers[bisect_left(frequencies, min_trials):]
+
+def top_k_by_duration(frequency_index, cancer_duration, min_trials, k):
+    """
+        Get the k cancer types with the longest average trial duration among
+        cancer types with at least a certain number of trials
+        
+        Parameters
+        ----------
+        frequency_index: tuple
+            a tuple returned by calling build_frequency_index
+        cancer_duration: dict
+            a dictionary returned by calling cancer_to_average_duration
+        min_trials: int
+            the minimum number of trials
+        k: int
+            number of cancer types to return
+            
+        Returns
+        -------
+        top_k: list
+            a list of (cancer type, average duration) tuples, longest first
+    """
+    candidates = ((cancer, cancer_duration[cancer])
+                  for cancer in conditions_with_min_frequency(frequency_index, min_trials)
+                  if cancer in cancer_duration)
+    return heapq.nlargest(k, candidates, key=itemgetter(1))
+
+def build_cohort_index(table):
+    """
+        Index trials by start date for time-bucketed queries. Start dates are
+        kept as a sorted array with running totals of trial durations, so that
+        the number of trials and their average duration over any range of
+        start dates are answered by binary search instead of scanning records.
+        
+        Parameters
+        ----------
+        table: tuple
+            the table header and rows returned by read_table
+            
+        Returns
+        -------
+        cohort_index: dict
+            cancer type, or None for all trials, to a dictionary of
+            'start': sorted array of start dates as ordinals
+            'duration_sum': running total of durations in days,
+                one longer than 'start'
+            'duration_count': running number of trials with a duration,
+                one longer than 'start'
+    """
+    header, rows = table
+    starts = {}
+    durations = {}
+    for row in rows:
+        start = select_entry(row, header, 'Start Date (ordinal)')
+        if start == 'null':
+            continue
+        duration = select_entry(row, header, 'Duration (day)')
+        duration = np.nan if duration == 'null' else int(duration)
+        conditions = [condition.strip() for condition in select_entry(row, header, 'Conditions').split('|')]
+        for condition in conditions + [None]:
+            starts.setdefault(condition, []).append(int(start))
+            durations.setdefault(condition, []).append(duration)
+    
+    cohort_index = {}
+    for condition in starts:
+        start = np.array(starts[condition], dtype=np.int64)
+        duration = np.array(durations[condition], dtype=float)
+        order = np.argsort(start, kind='stable')
+        start, duration = start[order], duration[order]
+        known = ~np.isnan(duration)
+        cohort_index[condition] = {
+            'start': start,
+            'duration_sum': np.concatenate(([0], np.cumsum(np.where(known, duration, 0)))),
+            'duration_count': np.concatenate(([0], np.cumsum(known)))}
+    return cohort_index
+
+@cached_metric
+def cohort_index_file(filename=DATA_FILE):
+    """
+        Build the cohort index of a processed CSV file, see build_cohort_index
+    """
+    return build_cohort_index(read_table(filename))
+
+def year_start_ordinal(years):
+    """
+        Get the ordinal of January 1 of each year, same as
+        datetime.date(year,1,1).toordinal() but for an array of years
+    """
+    y = np.asarray(years, dtype=np.int64) - 1
+    return 365*y + y//4 - y//100 + y//400 + 1
+
+def year_span(cohort_index, cancer=None):
+    """
+        Get the years of the earliest and the latest start date of a cancer type
+        
+        Parameters
+        ----------
+        cohort_index: dict
+            a dictionary returned by build_cohort_index
+        cancer: str (Optional, defaults to None)
+            a cancer type, all trials if not given
+            
+        Returns
+        -------
+        years: tuple
+            first year and last year
+    """
+    start = cohort_index[cancer]['start']
+    return (datetime.date.fromordinal(int(start[0])).year,
+            datetime.date.fromordinal(int(start[-1])).year)
+
+def trials_started(cohort_index, cancer, first_year, last_year):
+    """
+        Count trials of a cancer type started from first_year to last_year, inclusive
+        
+        Parameters
+        ----------
+        cohort_index: dict
+            a dictionary returned by build_cohort_index
+        cancer: str
+            a cancer type, None for all trials
+        first_year: int
+        last_year: int
+            
+        Returns
+        -------
+        count: int
+    """
+    lo, hi = np.searchsorted(cohort_index[cancer]['start'],
+                             year_start_ordinal([first_year, last_year + 1]))
+    return int(hi - lo)
+
+def trials_per_year(cohort_index, cancer, first_year, last_year):
+    """
+        Count trials of a cancer type started in each year from first_year
+        to last_year, inclusive
+        
+        Parameters
+        ----------
+        cohort_index: dict
+            a dictionary returned by build_cohort_index
+        cancer: str
+            a cancer type, None for all trials
+        first_year: int
+        last_year: int
+            
+        Returns
+        -------
+        years: numpy array
+        counts: numpy array
+            number of trials started in each year
+    """
+    years = np.arange(first_year, last_year + 1)
+    bounds = np.searchsorted(cohort_index[cancer]['start'],
+                             year_start_ordinal(np.arange(first_year, last_year + 2)))
+    return years, np.diff(bounds)
+
+def rolling_average_duration(cohort_index, cancer, first_year, last_year, window=3):
+    """
+        Get the average duration of trials of a cancer type by start cohort:
+        for each year, the trials started in that year and the window-1 years
+        before it
+        
+        Parameters
+        ----------
+        cohort_index: dict
+            a dictionary returned by build_cohort_index
+        cancer: str
+            a cancer type, None for all trials
+        first_year: int
+        last_year: int
+        window: int (Optional, defaults to 3)
+            number of start years in a cohort, at least 1
+            
+        Returns
+        -------
+        years: numpy array
+        averages: numpy array
+            average trial duration in years, NaN for cohorts without any duration
+    """
+    if window < 1:
+        raise ValueError("window must be at least 1 year, got {}".format(window))
+    cohorts = cohort_index[cancer]
+    years = np.arange(first_year, last_year + 1)
+    hi = np.searchsorted(cohorts['start'], year_start_ordinal(years + 1))
+    lo = np.searchsorted(cohorts['start'], year_start_ordinal(years + 1 - window))
+    total = cohorts['duration_sum'][hi] - cohorts['duration_sum'][lo]
+    count = cohorts['duration_count'][hi] - cohorts['duration_count'][lo]
+    average_day = np.divide(total, count, out=np.full(len(years), np.nan), where=count > 0)
+    return years, average_day / scrubbing.DAYS_PER_YEAR
+
+def cohort_report(cohort_index, cancers=None, first_year=None, last_year=None, window=3):
+    """
+        Tabulate trials started per year and the rolling average trial
+        duration for a list of cancer types
+        
+        Parameters
+        ----------
+        cohort_index: dict
+            a dictionary returned by build_cohort_index
+        cancers: list (Optional, defaults to None)
+            cancer types, all trials if not given
+        first_year: int (Optional, defaults to None)
+            defaults to the year of the earliest start date
+        last_year: int (Optional, defaults to None)
+            defaults to the year of the latest start date
+        window: int (Optional, defaults to 3)
+            number of start years in a cohort
+            
+        Returns
+        -------
+        report: list
+            (cancer type, year, trials started, rolling average duration) tuples
+    """
+    report = []
+    for cancer in cancers or [None]:
+        span = year_span(cohort_index, cancer)
+        first = first_year if first_year is not None else span[0]
+        last = last_year if last_year is not None else span[1]
+        years, counts = trials_per_year(cohort_index, cancer, first, last)
+        _, averages = rolling_average_duration(cohort_index, cancer, first, last, window)
+        for year, count, average in zip(years, counts, averages):
+            report.append((cancer or 'All trials', int(year), int(count), float(average)))
+    return report
+
+def write_cohort_report(report, window, fmt='text', output=None):
+    """
+        Write a report returned by cohort_report as a text table or CSV
+        
+        Parameters
+        ----------
+        report: list
+            a list returned by cohort_report
+        window: int
+            number of start years in a cohort, for the column name
+        fmt: str (Optional, defaults to 'text')
+            'text' or 'csv'
+        output: str (Optional, defaults to None)
+            path of the file to write to, sys.stdout if not given
+    """
+    header = ['Cancer', 'Year', 'Trials Started',
+              '{}-yr Rolling Avg. Trial Duration (yr)'.format(window)]
+    f = open(output,'w',newline='') if output is not None else sys.stdout
+    try:
+        if fmt == 'csv':
+            writer = csv.writer(f, delimiter=',')
+            writer.writerow(header)
+            for cancer, year, count, average in report:
+                writer.writerow([cancer, year, count, '' if np.isnan(average) else average])
+        else:
+            print("{:<40} {:>4} {:>14}  {}".format(*header), file=f)
+            for cancer, year, count, average in report:
+                print("{:<40} {:>4} {:>14}  {}".format(cancer[:40], year, count,
+                      'n/a' if np.isnan(average) else '{:.2f}'.format(average)), file=f)
+    finally:
+        if output is not None:
+            f.close()
+
+def print_ranking(ranking, value_label, file=None):
+    """
+        Print a ranked list of cancer types
+        
+        Parameters
+        ----------
+        ranking: list
+            a list of (cancer type, value) tuples
+        value_label: str
+            name of the value column
+        file: file object (Optional, defaults to None)
+            where to print to, sys.stdout if not given
+    """
+    print("{:>4}  {:<50} {}".format('Rank', 'Cancer', value_label), file=file)
+    for rank, (cancer, value) in enumerate(ranking, start=1):
+        print("{:>4}  {:<50} {:g}".format(rank, cancer[:50], value), file=file)
+
+def write_ranking(ranking, value_label, fmt='text', output=None):
+    """
+        Write a ranked list of cancer types as a text table or CSV
+        
+        Parameters
+        ----------
+        ranking: list
+            a list of (cancer type, value) tuples
+        value_label: str
+            name of the value column
+        fmt: str (Optional, defaults to 'text')
+            'text' or 'csv'
+        output: str (Optional, defaults to None)
+            path of the file to write to, sys.stdout if not given
+    """
+    f = open(output,'w',newline='') if output is not None else sys.stdout
+    try:
+        if fmt == 'csv':
+            writer = csv.writer(f, delimiter=',')
+            writer.writerow(['Rank','Cancer',value_label])
+            for rank, (cancer, value) in enumerate(ranking, start=1):
+                writer.writerow([rank, cancer, value])
+        else:
+            print_ranking(ranking, value_label, file=f)
+    finally:
+        if output is not None:
+            f.close()
+
+def prompt_positive_int(prompt):
+    """
+        Prompt the user until a positive integer is entered
+        
+        Parameters
+        ----------
+        prompt: str
+            the message shown to the user
+            
+        Returns
+        -------
+        number: int
+    """
+    while True:
+        answer = input(prompt).strip()
+        if answer.isnumeric() and int(answer) > 0:
+            return int(answer)
+        print("===================ERROR=======================")
+        print("This is not a valid number. Try again.")
+        print()
+
+def prompt_year(prompt):
+    """
+        Prompt the user until a year is entered, None if the user presses enter
+    """
+    while True:
+        answer = input(prompt).strip()
+        if answer == "":
+            return None
+        if answer.isnumeric() and int(answer) > 0:
+            return int(answer)
+        print("===================ERROR=======================")
+        print("This is not a valid year. Try again.")
+        print()
+
+def prompt_cohort_report(choice_of_cancers=None):
+    """
+        Prompt for a range of start years and a window, then print the
+        cohort report of a list of cancers
+        
+        Parameters
+        ----------
+        choice_of_cancers: list (Optional, defaults to None)
+            cancer types, all trials if not given
+            
+        Returns
+        -------
+        reported: bool
+            False if a cancer has no trial with a start date
+    """
+    cohort_index = cohort_index_file()
+    missing = [cancer for cancer in choice_of_cancers or [] if cancer not in cohort_index]
+    if missing:
+        print("===================ERROR=======================")
+        print("No trials with a start date for: " + ", ".join(missing) + ". Try again.")
+        print()
+        return False
+    
+    while True:
+        first_year = prompt_year("First start year (press enter for the earliest): ")
+        last_year = prompt_year("Last start year (press enter for the latest): ")
+        if first_year is None or last_year is None or first_year <= last_year:
+            break
+        print("===================ERROR=======================")
+        print("The first year must not be after the last year. Try again.")
+        print()
+    window = prompt_positive_int("How many start years per cohort? ")
+    print("===============================================")
+    write_cohort_report(cohort_report(cohort_index, choice_of_cancers, first_year, last_year, window), window)
+    return True
+
+def draw_hbar(choice_of_cancers=None, table=None, output="h-bar.png", fmt=None, show=True, store=None):
     """
         Plot a horizontal bar chart based on user's choice of cancers
         
@@ -265,18 +1327,32 @@ def draw_hbar(choice_of_cancers=None):
         ----------
         choice_of_cancers: list (Optional, defaults to None)
             a list of cancers the the user chooses
+        table: tuple (Optional, defaults to None)
+            the table header and rows returned by read_table,
+            the processed CSV file is read if not given
+        output: str (Optional, defaults to 'h-bar.png')
+            path to save the chart to
+        fmt: str (Optional, defaults to None)
+            file format of the chart, e.g. 'png', 'pdf' or 'svg',
+            inferred from the output path if not given
+        show: bool (Optional, defaults to True)
+            whether to show the chart in a window, set to False for batch runs
+        store: dict (Optional, defaults to None)
+            an aggregate store returned by build_aggregate_store,
+            built from the table if not given
 
     """    
     plt.clf()
-    cancer_duration_dict = cancer_to_average_duration()
+    if store is None:
+        store = load_store(table)
     
     if choice_of_cancers == None:
-        choice_of_cancers = ['Breast Cancer','Pancreatic Cancer','Lung Cancer','Colon Cancer',
-     'Bladder Cancer','Liver Cancer','Brain Cancer','Skin Cancer','Prostate Cancer',
-     'Colorectal Cancer','Head and Neck Cancer','Ovarian Cancer']
+        choice_of_cancers = list(DEFAULT_CANCERS)
         
-    duration_list = [cancer_duration_dict[key] for key in choice_of_cancers]
-    group_mean = compute_average(duration_list)
+    # cancers without any trial duration are masked out of the mean
+    duration_array = np.ma.masked_invalid(store['average_duration'][cancer_ids(store, choice_of_cancers)])
+    group_mean = duration_array.mean()
+    reference = store['duration_reference']
     
     #fig, ax = plt.subplots(figsize=(20,10))
     #plt.figure(figsize=(25,10))
@@ -287,17 +1363,27 @@ def draw_hbar(choice_of_cancers=None):
     #label the figure
     plt.xlabel('Avg. Trial Duration (in Yrs)')
     plt.title('Cancer by Avg. Trial Duration')
-    plt.axvline(group_mean, ls='--', color='m')
-    plt.barh(choice_of_cancers, duration_list)
+    plt.axvspan(reference['percentiles'][25], reference['percentiles'][75],
+                color='grey', alpha=0.15, label='Per-cancer averages, 25th-75th percentile')
+    plt.axvline(reference['mean'], ls=':', color='k', label='Mean of per-cancer averages')
+    plt.axvline(group_mean, ls='--', color='m', label='Selected cancers, mean')
+    # NaN bars are not drawn, cancers without any duration are labelled instead
+    plt.barh(choice_of_cancers, duration_array.filled(np.nan))
+    for position in np.flatnonzero(np.ma.getmaskarray(duration_array)):
+        plt.text(0, position, ' no data', va='center', fontsize=10, color='grey')
+    plt.legend(fontsize=8, loc='upper center', bbox_to_anchor=(0.5, -0.2), ncol=2)
     #plt.rcParams['figure.figsize'] = (500,500)
     #plt.rcParams['figure.autolayout'] = True
     plt.tight_layout()
-    plt.savefig("h-bar.png")
+    # the legend sits below the axes, outside the area tight_layout accounts for
+    plt.savefig(output, format=fmt, bbox_inches='tight')
     
-    plt.show()
-    #plt.close()
+    if show:
+        plt.show()
+    else:
+        plt.close()
 
-def draw_heatmap(choice_of_cancers=None):
+def draw_heatmap(choice_of_cancers=None, table=None, output="heatmap.png", fmt=None, show=True, store=None):
     """
         Plot a heatmap based on user's choice of cancers
         
@@ -305,38 +1391,40 @@ def draw_heatmap(choice_of_cancers=None):
         ----------
         choice_of_cancers: list (Optional, defaults to None)
             a list of cancers the the user chooses
+        table: tuple (Optional, defaults to None)
+            the table header and rows returned by read_table,
+            the processed CSV file is read if not given
+        output: str (Optional, defaults to 'heatmap.png')
+            path to save the chart to
+        fmt: str (Optional, defaults to None)
+            file format of the chart, e.g. 'png', 'pdf' or 'svg',
+            inferred from the output path if not given
+        show: bool (Optional, defaults to True)
+            whether to show the chart in a window, set to False for batch runs
+        store: dict (Optional, defaults to None)
+            an aggregate store returned by build_aggregate_store,
+            built from the table if not given
 
     """  
     plt.clf()
-    cancer_count = cancer_to_frequency()
-    master_dict = cancer_to_intervention_percentage(cancer_count)
+    if store is None:
+        store = load_store(table)
     
     # default choice is all cancers
     if choice_of_cancers == None:
-        choice_of_cancers = ['Breast Cancer','Pancreatic Cancer','Lung Cancer','Colon Cancer',
-     'Bladder Cancer','Liver Cancer','Brain Cancer','Skin Cancer','Prostate Cancer',
-     'Colorectal Cancer','Head and Neck Cancer','Ovarian Cancer']
+        choice_of_cancers = list(DEFAULT_CANCERS)
 
     intervention_list = ['Behavioral','Biological','Device','Genetic','Procedure','Radiation']
     
-    # build a 2d numpy array to parse in as heatmap parameter
-    percentage_list_2d = []
-    for cancer in choice_of_cancers:
-        percentage_list = []
-        for intervention in intervention_list:
-            if intervention in master_dict[cancer]:
-                percentage_list.append(master_dict[cancer][intervention])
-            else:
-                percentage_list.append(0)
-        percentage_list_2d.append(percentage_list)
-    percentage_array = np.array(percentage_list_2d)
+    # pull a 2d numpy array to parse in as heatmap parameter
+    percentage_array = intervention_matrix(store, cancer_ids(store, choice_of_cancers), intervention_list)
     
     # plot setting
-    #
-    fig, ax = plt.subplots(figsize=(25, 10))
+    # grow the figure with the selection, annotations are unreadable for large ones
+    fig, ax = plt.subplots(figsize=(25, max(10, 0.3*len(choice_of_cancers))))
     ax.xaxis.tick_top() # xlabels on the top
     sns.set(font_scale=1.4)
-    fig = sns.heatmap(percentage_array, annot=True, 
+    fig = sns.heatmap(percentage_array, annot=len(choice_of_cancers) <= MAX_ANNOTATED_ROWS, 
                 annot_kws={"size": 20},linewidths=2, linecolor='white',
                xticklabels = intervention_list,
                yticklabels = choice_of_cancers,cmap='Oranges',
@@ -346,11 +1434,13 @@ def draw_heatmap(choice_of_cancers=None):
     
     plt.tight_layout()# avoid cutting off x-labels when saving the figure
     
-    output = fig.get_figure()
+    output_fig = fig.get_figure()
 
-    output.savefig("heatmap.png")
-    plt.show()
-    #plt.close()
+    output_fig.savefig(output, format=fmt)
+    if show:
+        plt.show()
+    else:
+        plt.close(output_fig)
 
 def main():
     """
@@ -362,11 +1452,14 @@ def main():
     print()
     print("* 1. Horizontal Bar Chart: Cancer by Avg. Trial Duration")
     print("* 2. Heatmap: Non-Drug Intervention Utilization by Cancer")
+    print("* 3. Table: Top Cancers by Number of Trials")
+    print("* 4. Table: Cancers with at least N Trials by Avg. Trial Duration")
+    print("* 5. Table: Trials Started per Year and Rolling Avg. Trial Duration")
     print("===============================================")
     
     while True:
-        choice_of_engine = input("Please enter your choice of engine(1/2): ")
-        if choice_of_engine not in ['1','2']:
+        choice_of_engine = input("Please enter your choice of engine(1/2/3/4/5): ")
+        if choice_of_engine not in ['1','2','3','4','5']:
             print("===================ERROR=======================")
             print("This is not a valid choice. Try again.")
             print()
@@ -374,6 +1467,22 @@ def main():
         else:
             break
 
+    # table engines 3 and 4 query all cancers in the dataset, not the menu below
+    if choice_of_engine == '3':
+        k = prompt_positive_int("How many cancers to list? ")
+        print("===============================================")
+        print_ranking(top_k_by_frequency(aggregate_to_frequency(aggregate_file()), k), 'Trials')
+        return
+    elif choice_of_engine == '4':
+        min_trials = prompt_positive_int("Minimum number of trials per cancer: ")
+        k = prompt_positive_int("How many cancers to list? ")
+        aggregate = aggregate_file()
+        frequency_index = build_frequency_index(aggregate_to_frequency(aggregate))
+        print("===============================================")
+        print_ranking(top_k_by_duration(frequency_index, aggregate_to_average_duration(aggregate), min_trials, k),
+                      'Avg. Trial Duration (yr)')
+        return
+
     print()
     print("===============================================")
     print("Please choose from a list of cancers to create the graph:")
@@ -419,6 +1528,9 @@ def main():
                 draw_heatmap()
                 print("Please see 'heatmap.png' for output chart.")
                 break
+            elif choice_of_engine == '5':
+                prompt_cohort_report()
+                break
             
         keepGoing = False
         for choice in user_choice.split(","):
@@ -458,10 +1570,301 @@ def main():
             draw_heatmap(choice_of_cancers = choice_of_cancers)
             print("Please see 'heatmap.png' for output chart.")
             break
+        elif choice_of_engine == '5':
+            if prompt_cohort_report(choice_of_cancers):
+                break
             
      
-if __name__ == "__main__":
-    main()
+def run_engine(engine, table=None, choice_of_cancers=None, top_k=50, min_trials=1,
+               output=None, fmt=None, aggregate=None, first_year=None, last_year=None,
+               window=3, cohort_index=None, store=None):
+    """
+        Run an engine without prompts, on data already in memory
+        
+        Parameters
+        ----------
+        engine: str
+            one of the keys of ENGINE_FORMATS
+        table: tuple (Optional, defaults to None)
+            the table header and rows returned by read_table
+        choice_of_cancers: list (Optional, defaults to None)
+            cancers to chart, the default chart choice if not given,
+            or cancers to report on for the 'cohort' engine, all trials if not given
+        top_k: int (Optional, defaults to 50)
+            number of cancers to list for the table engines
+        min_trials: int (Optional, defaults to 1)
+            minimum number of trials per cancer for the 'duration' engine
+        output: str (Optional, defaults to None)
+            path to save the result to, charts default to 'h-bar.<fmt>'
+            and 'heatmap.<fmt>', tables are printed if not given
+        fmt: str (Optional, defaults to None)
+            output format, the first format in ENGINE_FORMATS if not given
+        aggregate: dict (Optional, defaults to None)
+            an aggregate returned by aggregate_table or merge_aggregates,
+            computed from the table if not given
+        first_year: int (Optional, defaults to None)
+            first start year for the 'cohort' engine, the earliest if not given
+        last_year: int (Optional, defaults to None)
+            last start year for the 'cohort' engine, the latest if not given
+        window: int (Optional, defaults to 3)
+            number of start years in a cohort for the 'cohort' engine
+        cohort_index: dict (Optional, defaults to None)
+            a dictionary returned by build_cohort_index,
+            computed from the table if not given
+        store: dict (Optional, defaults to None)
+            a dictionary returned by build_aggregate_store or store_file for
+            the chart engines, built from the aggregate if not given
             
-   
+        Returns
+        -------
+        output: str
+            path the result was saved to, None if printed
+    """
+    if engine == 'cohort':
+        if cohort_index is None:
+            cohort_index = build_cohort_index(table)
+    elif engine in ('hbar', 'heatmap'):
+        if store is None:
+            if aggregate is None:
+                aggregate = aggregate_table(table)
+            store = build_aggregate_store(aggregate)
+    elif aggregate is None:
+        aggregate = aggregate_table(table)
+    if fmt is None:
+        fmt = ENGINE_FORMATS[engine][0]
+    if engine == 'hbar':
+        output = output or 'h-bar.' + fmt
+        draw_hbar(choice_of_cancers, output=output, fmt=fmt, show=False,
+                  store=store)
+    elif engine == 'heatmap':
+        output = output or 'heatmap.' + fmt
+        draw_heatmap(choice_of_cancers, output=output, fmt=fmt, show=False,
+                     store=store)
+    elif engine == 'top':
+        write_ranking(top_k_by_frequency(aggregate_to_frequency(aggregate), top_k),
+                      'Trials', fmt, output)
+    elif engine == 'duration':
+        frequency_index = build_frequency_index(aggregate_to_frequency(aggregate))
+        write_ranking(top_k_by_duration(frequency_index, aggregate_to_average_duration(aggregate), min_trials, top_k),
+                      'Avg. Trial Duration (yr)', fmt, output)
+    elif engine == 'cohort':
+        write_cohort_report(cohort_report(cohort_index, choice_of_cancers, first_year, last_year, window),
+                            window, fmt, output)
+    return output
+
+def positive_int(value):
+    """
+        Parse a positive integer given on the command line
+    """
+    if not value.strip().isnumeric() or int(value) < 1:
+        raise argparse.ArgumentTypeError("must be a positive integer: {!r}".format(value))
+    return int(value)
+
+def split_cancers(value):
+    """
+        Split a comma separated list of cancers given on the command line
+    """
+    return [cancer.strip() for cancer in value.split(',') if cancer.strip()]
+
+def add_engine_arguments(parser):
+    """
+        Add the engine options to a command line parser
+    """
+    parser.add_argument('--engine', choices=sorted(ENGINE_FORMATS), default='hbar',
+                        help="chart or table to produce (default: %(default)s)")
+    parser.add_argument('--cancers', type=split_cancers,
+                        help="comma separated cancers to chart or report on "
+                             "(default: the interactive defaults, all trials for 'cohort')")
+    parser.add_argument('--top-k', type=int, default=50,
+                        help="number of cancers to list (default: %(default)s)")
+    parser.add_argument('--min-trials', type=int, default=1,
+                        help="minimum number of trials for the 'duration' engine (default: %(default)s)")
+    parser.add_argument('--first-year', type=int,
+                        help="first start year for the 'cohort' engine (default: the earliest)")
+    parser.add_argument('--last-year', type=int,
+                        help="last start year for the 'cohort' engine (default: the latest)")
+    parser.add_argument('--window', type=positive_int, default=3,
+                        help="start years per cohort for the 'cohort' engine (default: %(default)s)")
+    parser.add_argument('--save-as',
+                        help="file to save the result to (default: 'h-bar.<format>' or "
+                             "'heatmap.<format>' for charts, printed for tables)")
+    parser.add_argument('--format',
+                        help="output format: png, pdf or svg for charts, text or csv for tables")
+    parser.add_argument('--quiet', action='store_true',
+                        help="do not print where the result was saved")
+    parser.add_argument('--config',
+                        help="INI file with option defaults in sections [scrub] and [analytics]")
+
+def build_parser(defaults):
+    """
+        Build the command line parser
         
+        Parameters
+        ----------
+        defaults: dict
+            option defaults read from the config file
+            
+        Returns
+        -------
+        parser: argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(
+        description="Chart and rank cancers in the clinical trial dataset. "
+                    "Run without a command for the interactive program.")
+    subparsers = parser.add_subparsers(dest='command')
+    
+    render = subparsers.add_parser('render',
+        help="run an engine on the processed dataset without prompts, e.g. from cron")
+    render.add_argument('--data', default=DATA_FILE,
+                        help="processed CSV file (default: %(default)s)")
+    render.add_argument('--aggregate',
+                        help="merged aggregate file to use instead of the processed CSV file")
+    render.add_argument('--cache-dir',
+                        help="directory to cache the aggregate of the processed CSV file in across runs")
+    render.add_argument('--cache-stats', action='store_true',
+                        help="print hit and miss statistics of the cache")
+    add_engine_arguments(render)
+    
+    pipeline = subparsers.add_parser('pipeline',
+        help="scrub the raw dataset and run an engine on it in memory, "
+             "without writing the processed CSV file")
+    scrubbing.add_scrub_arguments(pipeline)
+    add_engine_arguments(pipeline)
+    
+    shard = subparsers.add_parser('shard',
+        help="scrub one shard of the raw dataset and write its partial aggregate")
+    shard.add_argument('--shard', type=scrubbing.parse_shard, required=True,
+                       help="shard INDEX/COUNT of the NCT Number hash range, e.g. 0/4")
+    
+    sharded = subparsers.add_parser('sharded',
+        help="run all shards in local processes and merge their partial aggregates")
+    sharded.add_argument('--num-shards', type=int, required=True,
+                         help="total number of shards")
+    
+    scrubbing.add_scrub_arguments(shard)
+    scrubbing.add_scrub_arguments(sharded, workers_help="number of shards run concurrently")
+    for subparser in (shard, sharded):
+        subparser.add_argument('--output-dir', default='.',
+                               help="directory for the shard files, created if missing (default: %(default)s)")
+    sharded.add_argument('--save-as',
+                         help="merged aggregate file (default: Aggregate.json in the output directory)")
+    
+    merge = subparsers.add_parser('merge',
+        help="merge partial aggregates of shards into the aggregate of the whole dataset")
+    merge.add_argument('aggregates', nargs='+',
+                       help="partial aggregate files written by 'shard'")
+    merge.add_argument('--save-as', default='Aggregate.json',
+                       help="merged aggregate file (default: %(default)s)")
+    
+    for subparser in (shard, sharded, merge):
+        subparser.add_argument('--config',
+            help="INI file with option defaults in sections [scrub] and [analytics]")
+    
+    for subparser in (render, pipeline, shard, sharded, merge):
+        subparser.set_defaults(**defaults)
+    return parser
+
+def cli(argv=None):
+    """
+        The command line entry point of the program
+        
+        Parameters
+        ----------
+        argv: list (Optional, defaults to None)
+            command line arguments, sys.argv[1:] if not given
+            
+        Returns
+        -------
+        status: int
+            the exit status
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = build_parser(scrubbing.config_defaults(argv, ['scrub','analytics']))
+    args = parser.parse_args(argv)
+    
+    if args.command is None:
+        main()
+        return 0
+    if args.command == 'shard':
+        print('Please see output file: '+run_shard(args.raw, args.shard, args.output_dir,
+                                                   args.workers, args.chunk_size, args.quarantine))
+        return 0
+    if args.command in ('sharded', 'merge'):
+        if args.command == 'sharded':
+            os.makedirs(args.output_dir, exist_ok=True)
+            aggregate = run_shards_locally(args.raw, args.num_shards, args.output_dir,
+                                           args.workers, args.chunk_size, args.quarantine)
+            if args.save_as is None:
+                args.save_as = os.path.join(args.output_dir, 'Aggregate.json')
+        else:
+            aggregate = merge_aggregates(load_aggregate(filename) for filename in args.aggregates)
+        save_aggregate(aggregate, args.save_as)
+        print('Please see output file: '+args.save_as)
+        return 0
+    # defaults from the config file skip the choices check of argparse
+    if args.engine not in ENGINE_FORMATS:
+        parser.error("invalid engine {!r} (choose from {})".format(
+            args.engine, ', '.join(sorted(ENGINE_FORMATS))))
+    if args.format is not None and args.format not in ENGINE_FORMATS[args.engine]:
+        parser.error("engine '{}' supports formats: {}".format(
+            args.engine, ', '.join(ENGINE_FORMATS[args.engine])))
+    
+    # batch runs never open a window
+    plt.switch_backend('Agg')
+    
+    aggregate = None
+    cohort_index = None
+    store = None
+    table = None
+    if args.command == 'render' and args.aggregate is not None:
+        # aggregates hold no start dates
+        if args.engine == 'cohort':
+            parser.error("engine 'cohort' needs --data, not --aggregate")
+        aggregate = load_aggregate(args.aggregate)
+    elif args.command == 'render':
+        if args.cache_dir is not None:
+            configure_cache(directory=args.cache_dir)
+        if args.engine == 'cohort':
+            cohort_index = cohort_index_file(args.data)
+        elif args.engine in ('hbar', 'heatmap'):
+            store = store_file(args.data)
+        else:
+            aggregate = aggregate_file(args.data)
+    else:
+        stats = {}
+        rows = scrubbing.scrub_file(args.raw, args.quarantine, stats, args.workers, args.chunk_size)
+        header = next(rows)
+        table = header, list(rows)
+        if not args.quiet:
+            print('Records processed: {}, dropped: {}, quarantined: {}'.format(
+                stats['processed'], stats['dropped'], stats['quarantined']), file=sys.stderr)
+        if args.engine == 'cohort':
+            cohort_index = build_cohort_index(table)
+        else:
+            aggregate = aggregate_table(table)
+    
+    if args.engine == 'cohort':
+        known, cancers = cohort_index, args.cancers or []
+    elif args.engine in ('hbar', 'heatmap'):
+        if store is None:
+            store = build_aggregate_store(aggregate)
+        known, cancers = store['cancer_index'], args.cancers or DEFAULT_CANCERS
+    else:
+        known, cancers = {}, []
+    unknown = [cancer for cancer in cancers if cancer not in known]
+    if unknown:
+        parser.error("cancers not in the dataset: {}".format(', '.join(unknown)))
+    
+    output = run_engine(args.engine, table, args.cancers, args.top_k, args.min_trials,
+                        args.save_as, args.format, aggregate, args.first_year, args.last_year,
+                        args.window, cohort_index, store)
+    if output is not None and not args.quiet:
+        print('Please see output file: '+output, file=sys.stderr)
+    if args.command == 'render' and args.cache_stats:
+        print('Cache: '+', '.join('{}={}'.format(key, value) for key, value in cache_info().items()),
+              file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,78 @@
+import csv
+import random
+
+import pytest
+
+import Module1_Data_Scrubbing as scrubbing
+import Module2_Interactive_Analytics as analytics
+
+HEADER = ['Rank','NCT Number','Title','Acronym','Status','Study Results','Conditions',
+          'Interventions','Outcome Measures','Sponsor/Collaborators','Gender','Age','Phases',
+          'Enrollment','Funded Bys','Study Type','Study Designs','Other IDs','Start Date',
+          'Primary Completion Date','Completion Date','First Posted','Results First Posted',
+          'Last Update Posted','Locations','Study Documents','URL']
+CONDITIONS = ['Breast Cancer','Lung Cancer','Leukemia','Skin Cancer','Ovarian Cancer']
+METHODS = ['Drug','Behavioral','Biological','Device','Procedure','Radiation']
+MONTHS = ['January','March','June','September','December']
+STUDY_DESIGNS = ('Allocation: Randomized|Intervention Model: Parallel Assignment|'
+                 'Masking: None (Open Label)|Primary Purpose: Treatment')
+
+def random_date(rng):
+    month, year = rng.choice(MONTHS), rng.randint(2000, 2020)
+    if rng.random() < 0.5:
+        return '{} {}'.format(month, year)
+    return '{} {}, {}'.format(month, rng.randint(1, 28), year)
+
+@pytest.fixture
+def raw_file(tmp_path):
+    rng = random.Random(0)
+    path = tmp_path / 'Raw_ClinicalTrial.csv'
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        for i in range(300):
+            # unique cell values, since columns are dropped by value
+            record = {column: '{}-{}'.format(column, i) for column in HEADER}
+            record['Rank'] = str(i + 1)
+            record['NCT Number'] = 'NCT{:08d}'.format(i)
+            record['Conditions'] = '|'.join(rng.sample(CONDITIONS, rng.randint(1, 3)))
+            record['Interventions'] = '|'.join('{}: name{}'.format(rng.choice(METHODS), k)
+                                               for k in range(rng.randint(1, 3)))
+            record['Study Type'] = rng.choice(['Interventional', 'Observational'])
+            record['Study Designs'] = STUDY_DESIGNS
+            record['Start Date'] = random_date(rng)
+            record['Completion Date'] = random_date(rng) if rng.random() < 0.9 else ''
+            writer.writerow([record[column] for column in HEADER])
+    return str(path)
+
+def full_aggregate(raw_file, tmp_path):
+    rows = scrubbing.scrub_file(raw_file, str(tmp_path / 'Quarantined_records.csv'), {})
+    header = next(rows)
+    return analytics.aggregate_table((header, list(rows)))
+
+def assert_same_aggregate(merged, expected):
+    assert merged['frequency'] == expected['frequency']
+    assert merged['duration_count'] == expected['duration_count']
+    assert merged['interventions'] == expected['interventions']
+    assert merged['duration_sum'].keys() == expected['duration_sum'].keys()
+    for condition, total in expected['duration_sum'].items():
+        assert merged['duration_sum'][condition] == pytest.approx(total)
+
+def test_merged_shards_equal_full_aggregate(raw_file, tmp_path):
+    output_dir = str(tmp_path / 'shards' / 'nested')
+    aggregate_files = [analytics.run_shard(raw_file, (index, 4), output_dir)
+                       for index in range(4)]
+    merged = analytics.merge_aggregates(analytics.load_aggregate(filename)
+                                        for filename in aggregate_files)
+    expected = full_aggregate(raw_file, tmp_path)
+    assert expected['frequency']
+    assert_same_aggregate(merged, expected)
+
+def test_merged_shards_give_same_metrics(raw_file, tmp_path):
+    output_dir = str(tmp_path / 'shards')
+    merged = analytics.merge_aggregates(analytics.load_aggregate(analytics.run_shard(raw_file, (index, 3), output_dir))
+                                        for index in range(3))
+    expected = full_aggregate(raw_file, tmp_path)
+    assert analytics.aggregate_to_frequency(merged) == analytics.aggregate_to_frequency(expected)
+    assert analytics.aggregate_to_average_duration(merged) == pytest.approx(
+        analytics.aggregate_to_average_duration(expected))